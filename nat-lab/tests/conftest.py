@@ -1,5 +1,6 @@
 import asyncio
 import pytest
+from utils.connection_util import close_cached_docker
 
 
 def _cancel_all_tasks(loop: asyncio.AbstractEventLoop):
@@ -33,6 +34,7 @@ def event_loop():
     finally:
         try:
             _cancel_all_tasks(loop)
+            loop.run_until_complete(close_cached_docker())
             loop.run_until_complete(loop.shutdown_asyncgens())
             loop.run_until_complete(loop.shutdown_default_executor())
         finally:
@@ -3,15 +3,27 @@ import json
 import os
 import re
 import shlex
-from collections import Counter
+from collections import Counter, defaultdict, deque
 from config import DERP_PRIMARY, DERP_SERVERS
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json, DataClassJsonMixin
 from enum import Enum
+from functools import lru_cache
 from mesh_api import Node
 from telio_features import TelioFeatures
-from typing import List, Dict, Any, Set, Optional, AsyncIterator
+from typing import (
+    List,
+    Dict,
+    Any,
+    Callable,
+    DefaultDict,
+    Deque,
+    Set,
+    Optional,
+    AsyncIterator,
+    Tuple,
+)
 from utils import testing, asyncio_util
 from utils.connection import Connection, TargetOS
 from utils.connection_util import get_libtelio_binary_path
@@ -19,6 +31,30 @@ from utils.output_notifier import OutputNotifier
 from utils.process import Process
 from utils.router import Router, new_router
 
+# Log lines which are too chatty to echo to the test output. The prefixed ones
+# are matched with startswith, the rest with a single compiled alternation, so
+# the suppression check is one C-level pass per line
+_SUPPRESS_PRINT_PREFIXES = ("MESSAGE_DONE=", "task stopped - ", "task started - ")
+_SUPPRESS_PRINT_PATTERN = re.compile(r"- no login\.|- telio running\.|- telio nodes")
+
+# Most command arguments repeat across calls (subcommands, keys, interface
+# names); large one-off arguments like meshmap JSON bypass the cache
+_quote = lru_cache(maxsize=1024)(shlex.quote)
+
+# Per-key state history kept by the runtime; long soak tests would otherwise
+# grow it without bound
+_MAX_EVENT_HISTORY = 64
+
+# Built once from config constants
+_DERP01_SERVER_JSON = json.dumps(
+    {
+        "host": str(DERP_PRIMARY["hostname"]),
+        "ipv4": str(DERP_PRIMARY["ipv4"]),
+        "port": DERP_PRIMARY["relay_port"],
+        "pk": str(DERP_PRIMARY["public_key"]),
+    }
+)
+
 
 # Equivalent of `libtelio/telio-wg/src/uapi.rs`
 class State(Enum):
@@ -50,22 +86,66 @@ class DerpServer(DataClassJsonMixin):
     # Only for compatibility with telio v3.6
     used: bool = False
 
+    @classmethod
+    def from_event(cls, data: Dict[str, Any]) -> "DerpServer":
+        # Direct construction; dataclasses-json's reflective from_json is far
+        # too slow for the per-line event path
+        return cls(
+            region_code=data["region_code"],
+            name=data["name"],
+            hostname=data["hostname"],
+            ipv4=data["ipv4"],
+            relay_port=data["relay_port"],
+            stun_port=data["stun_port"],
+            stun_plaintext_port=data["stun_plaintext_port"],
+            public_key=data["public_key"],
+            weight=data["weight"],
+            use_plain_text=data["use_plain_text"],
+            conn_state=State(data["conn_state"]),
+            used=data.get("used", False),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, DerpServer):
+            return False
+        # "used" only exists for telio v3.6 compatibility and carries no state
+        return (
+            self.region_code == other.region_code
+            and self.name == other.name
+            and self.hostname == other.hostname
+            and self.ipv4 == other.ipv4
+            and self.relay_port == other.relay_port
+            and self.stun_port == other.stun_port
+            and self.stun_plaintext_port == other.stun_plaintext_port
+            and self.public_key == other.public_key
+            and self.weight == other.weight
+            and self.use_plain_text == other.use_plain_text
+            and self.conn_state == other.conn_state
+        )
+
     def __hash__(self):
-        return hash(
-            (
-                self.region_code,
-                self.name,
-                self.hostname,
-                self.ipv4,
-                self.relay_port,
-                self.stun_port,
-                self.stun_plaintext_port,
-                self.public_key,
-                self.weight,
-                self.use_plain_text,
-                self.conn_state,
+        # Cached outside the dataclass fields so equality and JSON
+        # (de)serialization are unaffected
+        cached = getattr(self, "_hash", None)
+        if cached is None:
+            cached = hash(
+                (
+                    self.region_code,
+                    self.name,
+                    self.hostname,
+                    self.ipv4,
+                    self.relay_port,
+                    self.stun_port,
+                    self.stun_plaintext_port,
+                    self.public_key,
+                    self.weight,
+                    self.use_plain_text,
+                    self.conn_state,
+                )
             )
-        )
+            # pylint: disable-next=attribute-defined-outside-init
+            self._hash = cached
+        return cached
 
 
 # Equivalent of `libtelio/crates/telio-model/src/mesh.rs:Node`
@@ -85,23 +165,45 @@ class PeerInfo(DataClassJsonMixin):
     allow_peer_send_files: bool = False
     path: PathType = PathType.Relay
 
+    @classmethod
+    def from_event(cls, data: Dict[str, Any]) -> "PeerInfo":
+        return cls(
+            identifier=data.get("identifier", ""),
+            public_key=data.get("public_key", ""),
+            state=State(data.get("state", "disconnected")),
+            is_exit=data.get("is_exit", False),
+            is_vpn=data.get("is_vpn", False),
+            ip_addresses=data.get("ip_addresses", []),
+            allowed_ips=data.get("allowed_ips", []),
+            endpoint=data.get("endpoint"),
+            hostname=data.get("hostname"),
+            allow_incoming_connections=data.get("allow_incoming_connections", False),
+            allow_peer_send_files=data.get("allow_peer_send_files", False),
+            path=PathType(data.get("path", "relay")),
+        )
+
     def __hash__(self):
-        return hash(
-            (
-                self.identifier,
-                self.public_key,
-                self.state,
-                self.is_exit,
-                self.is_vpn,
-                tuple(self.ip_addresses),
-                tuple(self.allowed_ips),
-                self.endpoint,
-                self.hostname,
-                self.allow_incoming_connections,
-                self.allow_peer_send_files,
-                self.path,
+        cached = getattr(self, "_hash", None)
+        if cached is None:
+            cached = hash(
+                (
+                    self.identifier,
+                    self.public_key,
+                    self.state,
+                    self.is_exit,
+                    self.is_vpn,
+                    tuple(self.ip_addresses),
+                    tuple(self.allowed_ips),
+                    self.endpoint,
+                    self.hostname,
+                    self.allow_incoming_connections,
+                    self.allow_peer_send_files,
+                    self.path,
+                )
             )
-        )
+            # pylint: disable-next=attribute-defined-outside-init
+            self._hash = cached
+        return cached
 
     def __eq__(self, other):
         if not isinstance(other, PeerInfo):
@@ -129,6 +231,25 @@ class PeerInfo(DataClassJsonMixin):
             and self.path == other.path
         )
 
+    def same_event(self, other: "PeerInfo") -> bool:
+        # Strict field-by-field comparison for event deduplication; __eq__
+        # treats a None endpoint/hostname as a wildcard for assertion
+        # matching, which would classify an endpoint-only change as a repeat
+        return (
+            self.identifier == other.identifier
+            and self.public_key == other.public_key
+            and self.state == other.state
+            and self.is_exit == other.is_exit
+            and self.is_vpn == other.is_vpn
+            and self.ip_addresses == other.ip_addresses
+            and self.allowed_ips == other.allowed_ips
+            and self.endpoint == other.endpoint
+            and self.hostname == other.hostname
+            and self.allow_incoming_connections == other.allow_incoming_connections
+            and self.allow_peer_send_files == other.allow_peer_send_files
+            and self.path == other.path
+        )
+
 
 # Equivalent of `libtelio/telio-wg/src/adapter/mod.rs`
 class AdapterType(Enum):
@@ -141,44 +262,63 @@ class AdapterType(Enum):
 
 class Runtime:
     _output_notifier: OutputNotifier
-    _peer_state_events: List[PeerInfo]
-    _derp_state_events: List[DerpServer]
+    _peer_state_events: DefaultDict[str, Deque[PeerInfo]]
+    _derp_state_events: DefaultDict[str, Deque[DerpServer]]
+    _peer_seq: DefaultDict[str, int]
+    _derp_seq: DefaultDict[str, int]
+    _peer_update: DefaultDict[str, asyncio.Event]
+    _derp_update: DefaultDict[str, asyncio.Event]
+    _activity: asyncio.Event
     _started_tasks: List[str]
     _stopped_tasks: List[str]
+    _line_handlers: Tuple[Tuple[str, Callable[[str], bool]], ...]
     allowed_pub_keys: Set[str]
 
     def __init__(self) -> None:
         self._output_notifier = OutputNotifier()
-        self._peer_state_events = []
-        self._derp_state_events = []
+        # Event history is kept per public key / server IP, so lookups scan
+        # only the history of the key in question. Histories are bounded;
+        # waiters track their position with the per-key sequence counters.
+        self._peer_state_events = defaultdict(lambda: deque(maxlen=_MAX_EVENT_HISTORY))
+        self._derp_state_events = defaultdict(lambda: deque(maxlen=_MAX_EVENT_HISTORY))
+        self._peer_seq = defaultdict(int)
+        self._derp_seq = defaultdict(int)
+        self._peer_update = defaultdict(asyncio.Event)
+        self._derp_update = defaultdict(asyncio.Event)
+        self._activity = asyncio.Event()
         self._started_tasks = []
         self._stopped_tasks = []
+        self._line_handlers = (
+            ("event node: ", self._handle_node_event),
+            ("event relay: ", self._handle_derp_event),
+            ("task started - ", self._handle_task_started),
+            ("task stopped - ", self._handle_task_stopped),
+        )
         self.allowed_pub_keys = set()
 
     def handle_output_line(self, line) -> bool:
-        return (
-            self._handle_node_event(line)
-            or self._output_notifier.handle_output(line)
-            or self._handle_derp_event(line)
-            or self._handle_task_information(line)
-        )
-
-    def _handle_task_information(self, line) -> bool:
-        if line.startswith("task started - "):
-            tokens = line.split("task started - ")
-            self._started_tasks.append(tokens[1].strip())
-            return True
-
-        if line.startswith("task stopped - "):
-            tokens = line.split("task stopped - ")
-            self._stopped_tasks.append(tokens[1].strip())
-            return True
-
-        return False
+        # Handlers receive the line with its prefix already sliced off
+        for prefix, handler in self._line_handlers:
+            if line.startswith(prefix):
+                if handler(line[len(prefix) :]):
+                    return True
+                break
+        return self._output_notifier.handle_output(line)
+
+    def _handle_task_started(self, payload) -> bool:
+        self._started_tasks.append(payload.strip())
+        return True
+
+    def _handle_task_stopped(self, payload) -> bool:
+        self._stopped_tasks.append(payload.strip())
+        return True
 
     def get_output_notifier(self) -> OutputNotifier:
         return self._output_notifier
 
+    def get_activity_event(self) -> asyncio.Event:
+        return self._activity
+
     async def notify_peer_state(
         self,
         public_key: str,
@@ -186,10 +326,13 @@ class Runtime:
         paths: List[PathType],
     ) -> None:
         while True:
+            # Grab the update event before checking the predicate, so updates
+            # arriving in between are not missed
+            update = self._peer_update[public_key]
             peer = self.get_peer_info(public_key)
             if peer and peer.path in paths and peer.state in states:
                 return
-            await asyncio.sleep(0.1)
+            await update.wait()
 
     async def notify_peer_event(
         self,
@@ -197,30 +340,24 @@ class Runtime:
         states: List[State],
         paths: List[PathType],
     ) -> None:
-        def _get_events() -> List[PeerInfo]:
-            return [
-                peer
-                for peer in self._peer_state_events
-                if peer
-                and peer.public_key == public_key
-                and peer.path in paths
-                and peer.state in states
-            ]
-
-        old_events = _get_events()
+        seen = self._peer_seq[public_key]
 
         while True:
-            new_events = _get_events()[len(old_events) :]
-            if new_events:
-                return
-            await asyncio.sleep(0.1)
+            update = self._peer_update[public_key]
+            seq = self._peer_seq[public_key]
+            if seq > seen:
+                events = self._peer_state_events[public_key]
+                fresh = min(seq - seen, len(events))
+                if any(
+                    peer.path in paths and peer.state in states
+                    for peer in list(events)[-fresh:]
+                ):
+                    return
+                seen = seq
+            await update.wait()
 
     def get_peer_info(self, public_key: str) -> Optional[PeerInfo]:
-        events = [
-            peer_event
-            for peer_event in self._peer_state_events
-            if peer_event.public_key == public_key
-        ]
+        events = self._peer_state_events.get(public_key)
         if events:
             return events[-1]
         return None
@@ -231,76 +368,88 @@ class Runtime:
         states: List[State],
     ) -> None:
         while True:
+            update = self._derp_update[server_ip]
             derp = self.get_derp_info(server_ip)
-            if derp and derp.ipv4 == server_ip and derp.conn_state in states:
+            if derp and derp.conn_state in states:
                 return
-            await asyncio.sleep(0.1)
+            await update.wait()
 
     async def notify_derp_event(
         self,
         server_ip: str,
         states: List[State],
     ) -> None:
-        def _get_events() -> List[DerpServer]:
-            return [
-                event
-                for event in self._derp_state_events
-                if event.ipv4 == server_ip and event.conn_state in states
-            ]
-
-        old_events = _get_events()
+        seen = self._derp_seq[server_ip]
 
         while True:
-            new_events = _get_events()[len(old_events) :]
-            if new_events:
-                return
-            await asyncio.sleep(0.1)
+            update = self._derp_update[server_ip]
+            seq = self._derp_seq[server_ip]
+            if seq > seen:
+                events = self._derp_state_events[server_ip]
+                fresh = min(seq - seen, len(events))
+                if any(event.conn_state in states for event in list(events)[-fresh:]):
+                    return
+                seen = seq
+            await update.wait()
 
     def get_derp_info(self, server_ip: str) -> Optional[DerpServer]:
-        events = [event for event in self._derp_state_events if event.ipv4 == server_ip]
+        events = self._derp_state_events.get(server_ip)
         if events:
             return events[-1]
         return None
 
     def set_peer(self, peer: PeerInfo) -> None:
         assert peer.public_key in self.allowed_pub_keys
-        self._peer_state_events.append(peer)
-
-    def _handle_node_event(self, line) -> bool:
-        if not line.startswith("event node: "):
+        events = self._peer_state_events[peer.public_key]
+        # tcli may re-emit an unchanged node state; don't wake waiters for it.
+        # Compared with same_event, not __eq__, so that e.g. an endpoint-only
+        # change still counts as a new event
+        if events and peer.same_event(events[-1]):
+            return
+        events.append(peer)
+        self._peer_seq[peer.public_key] += 1
+        # All waiters share the per-key event, so one set() broadcasts the
+        # update; removing it makes the next waiter start on a fresh one
+        update = self._peer_update.pop(peer.public_key, None)
+        if update:
+            update.set()
+        self._activity.set()
+
+    def _handle_node_event(self, payload) -> bool:
+        json_string = payload.strip()
+        start = json_string.find("{")
+        end = json_string.rfind("}")
+        if start < 0 or end < start:
             return False
-        tokens = line.split("event node: ")
-        json_string = tokens[1].strip()
-        result = re.search("{(.*)}", json_string)
-        if result:
-            node_state = PeerInfo.from_json(
-                "{" + result.group(1).replace("\\", "") + "}"
-            )
-            assert isinstance(node_state, PeerInfo)
-            self.set_peer(node_state)
-            return True
-        return False
+        payload = json_string[start : end + 1]
+        if "\\" in payload:
+            payload = payload.replace("\\", "")
+        self.set_peer(PeerInfo.from_event(json.loads(payload)))
+        return True
 
     def set_derp(self, derp: DerpServer) -> None:
-        self._derp_state_events.append(derp)
-
-    def _handle_derp_event(self, line) -> bool:
-        if not line.startswith("event relay: "):
+        events = self._derp_state_events[derp.ipv4]
+        if events and events[-1] == derp:
+            return
+        events.append(derp)
+        self._derp_seq[derp.ipv4] += 1
+        update = self._derp_update.pop(derp.ipv4, None)
+        if update:
+            update.set()
+        self._activity.set()
+
+    def _handle_derp_event(self, payload) -> bool:
+        json_string = payload.strip()
+        start = json_string.find("{")
+        end = json_string.rfind("}")
+        if start < 0 or end < start:
             return False
-        tokens = line.split("event relay: ")
-        json_string = tokens[1].strip()
-        result = re.search("{(.*)}", json_string)
-        if result:
-            derp_server_json = DerpServer.from_json(
-                # Added "used" variable for compatibility with telio 3.6
-                "{"
-                + result.group(1).replace("\\", "")
-                + "}"
-            )
-            assert isinstance(derp_server_json, DerpServer)
-            self.set_derp(derp_server_json)
-            return True
-        return False
+        payload = json_string[start : end + 1]
+        if "\\" in payload:
+            payload = payload.replace("\\", "")
+        # "used" field is defaulted for compatibility with telio 3.6
+        self.set_derp(DerpServer.from_event(json.loads(payload)))
+        return True
 
     def get_started_tasks(self) -> List[str]:
         return self._started_tasks
@@ -356,6 +505,12 @@ class Events:
         await self._runtime.notify_derp_event(server_ip, states)
 
 
+def _write_log_file(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
 class Client:
     def __init__(
         self,
@@ -379,16 +534,11 @@ class Client:
     @asynccontextmanager
     async def run(self, telio_v3=False) -> AsyncIterator["Client"]:
         async def on_stdout(stdout: str) -> None:
-            supress_print_list = [
-                "MESSAGE_DONE=",
-                "- no login.",
-                "- telio running.",
-                "- telio nodes",
-                "task stopped - ",
-                "task started - ",
-            ]
             for line in stdout.splitlines():
-                if not any(string in line for string in supress_print_list):
+                if not (
+                    line.startswith(_SUPPRESS_PRINT_PREFIXES)
+                    or _SUPPRESS_PRINT_PATTERN.search(line)
+                ):
                     print(f"[{self._node.name}]: {line}")
                 if self._runtime:
                     self._runtime.handle_output_line(line)
@@ -411,7 +561,7 @@ class Client:
                 [
                     tcli_path,
                     "--less-spam",
-                    f"-f {self._telio_features.to_json()}",
+                    f"-f {self._telio_features.features_json}",
                 ]
             )
         async with self._process.run(stdout_callback=on_stdout):
@@ -489,8 +639,7 @@ class Client:
             ]
         ) as futures:
             try:
-                while not any(fut.done() for fut in futures):
-                    await asyncio.sleep(0.01)
+                await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
             except asyncio.CancelledError:
                 pass
 
@@ -504,8 +653,7 @@ class Client:
             ]
         ) as futures:
             try:
-                while not all(fut.done() for fut in futures):
-                    await asyncio.sleep(0.1)
+                await asyncio.wait(futures, return_when=asyncio.ALL_COMPLETED)
             except asyncio.CancelledError:
                 pass
 
@@ -520,8 +668,7 @@ class Client:
             ]
         ) as futures:
             try:
-                while not any(fut.done() for fut in futures):
-                    await asyncio.sleep(0.1)
+                await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
             except asyncio.CancelledError:
                 pass
 
@@ -631,29 +778,25 @@ class Client:
         return self.get_runtime().get_derp_info(server_ip)
 
     async def _event_request_loop(self) -> None:
+        # tcli only reports events when asked, so this loop is the delivery
+        # mechanism. Drain again right away while a burst of state changes is
+        # coming in; on an idle meshnet this wakes only once per second.
+        activity = self.get_runtime().get_activity_event()
         while True:
             try:
+                activity.clear()
                 await self._write_command(["events"])
-                await asyncio.sleep(1)
+                try:
+                    await asyncio.wait_for(activity.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
             except:
                 if self._quit:
                     return
                 raise
 
     async def create_fake_derprelay_to_derp01(self, sk: str, allowed_pk: str) -> None:
-        derp01_server = (
-            '{"host":"'
-            + str(DERP_PRIMARY["hostname"])
-            + '","ipv4":"'
-            + str(DERP_PRIMARY["ipv4"])
-            + '","port":'
-            + str(DERP_PRIMARY["relay_port"])
-            + ',"pk":"'
-            + str(DERP_PRIMARY["public_key"])
-            + '"}'
-        )
-
-        await self._write_command(["derp", "on", sk, derp01_server, allowed_pk])
+        await self._write_command(["derp", "on", sk, _DERP01_SERVER_JSON, allowed_pk])
 
     async def disconnect_fake_derprelay(self) -> None:
         await self._write_command(["derp", "off"])
@@ -673,8 +816,10 @@ class Client:
     async def _write_command(self, command: List[str]) -> None:
         idx = self._message_idx
         cmd = (
-            f"MESSAGE_ID={str(idx)} "
-            + " ".join([shlex.quote(arg) for arg in command])
+            f"MESSAGE_ID={idx} "
+            + " ".join(
+                _quote(arg) if len(arg) < 256 else shlex.quote(arg) for arg in command
+            )
             + "\n"
         )
         await self.get_process().write_stdin(cmd)
@@ -700,7 +845,6 @@ class Client:
             return
 
         log_dir = "logs"
-        os.makedirs(log_dir, exist_ok=True)
 
         process = (
             connection.create_process(["type", "tcli.log"])
@@ -722,9 +866,9 @@ class Client:
             test_name = "".join(
                 [x if x.isalnum() else "_" for x in test_name.split(" ")[0]]
             )
-        with open(
+        # Write on the thread pool so a large log dump doesn't stall the loop
+        await asyncio.to_thread(
+            _write_log_file,
             os.path.join(log_dir, str(test_name) + "_" + container_id + ".log"),
-            "w",
-            encoding="utf-8",
-        ) as f:
-            f.write(log_content)
+            log_content,
+        )
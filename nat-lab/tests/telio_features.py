@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json, Undefined, DataClassJsonMixin
+from functools import cached_property
 from typing import Optional, List
 
 
@@ -52,3 +53,9 @@ class TelioFeatures(DataClassJsonMixin):
     direct: Optional[Direct] = None
     lana: Optional[Lana] = None
     nurse: Optional[Nurse] = None
+
+    @cached_property
+    def features_json(self) -> str:
+        # Features are never mutated once a client is set up, so the encoded
+        # form is computed at most once
+        return self.to_json()
@@ -109,6 +109,32 @@ class TestRuntime:
                 runtime.notify_peer_event("AAA", [State.Connected], [PathType.Relay])
             )
 
+    @pytest.mark.asyncio
+    async def test_set_peer_deduplication(self) -> None:
+        runtime = Runtime()
+        runtime.allowed_pub_keys = set(["AAA"])
+
+        runtime.set_peer(PeerInfo(public_key="AAA", state=State.Connected))
+
+        async with run_async_context(
+            runtime.notify_peer_event("AAA", [State.Connected], [PathType.Relay])
+        ) as future:
+            # wait for futures to be started
+            await asyncio.sleep(0)
+
+            # An identical re-emission is dropped and wakes nobody
+            runtime.set_peer(PeerInfo(public_key="AAA", state=State.Connected))
+            with pytest.raises(asyncio.TimeoutError):
+                await testing.wait_short(asyncio.shield(future))
+
+            # An endpoint-only change is a real update and must be kept
+            runtime.set_peer(
+                PeerInfo(
+                    public_key="AAA", state=State.Connected, endpoint="1.2.3.4:5678"
+                )
+            )
+            await testing.wait_short(future)
+
     @pytest.mark.asyncio
     async def test_set_derp_state(self) -> None:
         runtime = Runtime()
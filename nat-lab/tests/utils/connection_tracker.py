@@ -1,6 +1,6 @@
 import asyncio
 import re
-import time
+from collections import Counter
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from typing import Optional, List, Dict, AsyncIterator
@@ -8,6 +8,15 @@ from utils.connection import Connection
 from utils.ping import Ping
 from utils.process import Process
 
+# Conntrack events have a stable field order, so a single pass extracts the
+# whole five-tuple instead of rescanning the line once per field
+_RE_CONNTRACK_EVENT = re.compile(
+    r"\[NEW\] (?P<protocol>\w+)"
+    r".*?src=(?P<src_ip>\S+)\s+dst=(?P<dst_ip>\S+)"
+    r"(?:.*?sport=(?P<src_port>\d+))?"
+    r"(?:.*?dport=(?P<dst_port>\d+))?"
+)
+
 
 @dataclass
 class FiveTuple:
@@ -41,29 +50,19 @@ class ConnectionTrackerConfig:
 
 
 def parse_input(input_string) -> FiveTuple:
-    five_tuple = FiveTuple()
-
-    match = re.search(r"\[NEW\] (\w+)", input_string)
-    if match:
-        five_tuple.protocol = match.group(1)
-
-    match = re.search(r"src=([^\s]+)", input_string)
-    if match:
-        five_tuple.src_ip = match.group(1)
-
-    match = re.search(r"dst=([^\s]+)", input_string)
-    if match:
-        five_tuple.dst_ip = match.group(1)
-
-    match = re.search(r"sport=(\d+)", input_string)
-    if match:
-        five_tuple.src_port = int(match.group(1))
+    match = _RE_CONNTRACK_EVENT.search(input_string)
+    if not match:
+        return FiveTuple()
 
-    match = re.search(r"dport=(\d+)", input_string)
-    if match:
-        five_tuple.dst_port = int(match.group(1))
-
-    return five_tuple
+    src_port = match.group("src_port")
+    dst_port = match.group("dst_port")
+    return FiveTuple(
+        protocol=match.group("protocol"),
+        src_ip=match.group("src_ip"),
+        dst_ip=match.group("dst_ip"),
+        src_port=int(src_port) if src_port else None,
+        dst_port=int(dst_port) if dst_port else None,
+    )
 
 
 class ConnectionTracker:
@@ -72,16 +71,22 @@ class ConnectionTracker:
         connection: Connection,
         configuration: Optional[List[ConnectionTrackerConfig]] = None,
     ):
-        self._process: Process = connection.create_process(
-            ["conntrack", "-E", "-e", "NEW"]
+        # Without a configuration the tracker is a pure no-op, so don't even
+        # create the conntrack process
+        self._process: Optional[Process] = (
+            connection.create_process(["conntrack", "-E", "-e", "NEW"])
+            if configuration
+            else None
         )
         self._connection: Connection = connection
         self._config: Optional[List[ConnectionTrackerConfig]] = configuration
-        self._events: List[FiveTuple] = []
+        # Matches are counted per config key at ingest time, so limit checks
+        # don't have to rescan the whole event history
+        self._match_counts: Counter = Counter()
         self._last_event: Optional[FiveTuple] = None
         self._events_wait_list: Dict[str, List[asyncio.Event]] = {}
 
-        self._initialized: bool = False
+        self._initialized: asyncio.Event = asyncio.Event()
         self._init_connection: FiveTuple = FiveTuple(
             protocol="icmp", dst_ip="127.0.0.1"
         )
@@ -92,12 +97,12 @@ class ConnectionTracker:
 
         for line in stdout.splitlines():
             connection = parse_input(line)
-            if connection is FiveTuple():
+            if connection == FiveTuple():
                 continue
 
-            if not self._initialized:
+            if not self._initialized.is_set():
                 if self._init_connection.partial_eq(connection):
-                    self._initialized = True
+                    self._initialized.set()
                     continue
 
             matching_configs = [
@@ -106,16 +111,16 @@ class ConnectionTracker:
             if not matching_configs:
                 continue
 
-            self._events.append(connection)
             self._last_event = connection
 
             for cfg in matching_configs:
+                self._match_counts[cfg.key] += 1
                 if events := self._events_wait_list.pop(cfg.key, None):
                     for event in events:
                         event.set()
 
     async def execute(self) -> None:
-        if not self._config:
+        if not self._config or self._process is None:
             return
 
         await self._process.execute(stdout_callback=self.on_stdout)
@@ -127,9 +132,7 @@ class ConnectionTracker:
         out_of_limit_connections: Dict[str, int] = {}
 
         for cfg in self._config:
-            count = len(
-                [event for event in self._events if cfg.target.partial_eq(event)]
-            )
+            count = self._match_counts[cfg.key]
             if cfg.limits.max is not None:
                 if count > cfg.limits.max:
                     out_of_limit_connections[cfg.key] = count
@@ -162,17 +165,19 @@ class ConnectionTracker:
 
     @asynccontextmanager
     async def run(self) -> AsyncIterator["ConnectionTracker"]:
+        if not self._config or self._process is None:
+            yield self
+            return
+
         async with self._process.run(stdout_callback=self.on_stdout):
             await self._process.wait_stdin_ready()
             # initialization is just waiting for first conntrack event,
             # since it has no other indication if it is truly running.
             # Or wait for 1 second and pray it was initialized
             async with Ping(self._connection, "127.0.0.1").run():
-                start_time = time.time()
-                while not self._initialized:
-                    if time.time() - start_time >= 1:
-                        self._initialized = True
-                        break
-                    await asyncio.sleep(0.1)
+                try:
+                    await asyncio.wait_for(self._initialized.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    self._initialized.set()
 
             yield self
@@ -1,8 +1,21 @@
+import asyncio
 import config
 from aiodocker import Docker
-from contextlib import asynccontextmanager
-from enum import Enum, auto
-from typing import AsyncIterator, Dict, Tuple, Optional, List
+from contextlib import asynccontextmanager, AsyncExitStack
+from enum import IntEnum
+from types import MappingProxyType
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Mapping,
+    NamedTuple,
+    Tuple,
+    Optional,
+    List,
+)
 from utils.connection import Connection, TargetOS
 from utils.connection_tracker import (
     ConnectionTracker,
@@ -19,177 +32,271 @@ from utils.network_switcher import (
 from utils.vm import container_util, windows_vm_util, mac_vm_util
 
 
-class ConnectionTag(Enum):
-    DOCKER_CONE_CLIENT_1 = auto()
-    DOCKER_CONE_CLIENT_2 = auto()
-    DOCKER_FULLCONE_CLIENT_1 = auto()
-    DOCKER_FULLCONE_CLIENT_2 = auto()
-    DOCKER_SYMMETRIC_CLIENT_1 = auto()
-    DOCKER_SYMMETRIC_CLIENT_2 = auto()
-    DOCKER_UPNP_CLIENT_1 = auto()
-    DOCKER_UPNP_CLIENT_2 = auto()
-    DOCKER_SHARED_CLIENT_1 = auto()
-    DOCKER_OPEN_INTERNET_CLIENT_1 = auto()
-    DOCKER_OPEN_INTERNET_CLIENT_2 = auto()
-    DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK = auto()
-    DOCKER_UDP_BLOCK_CLIENT_1 = auto()
-    DOCKER_UDP_BLOCK_CLIENT_2 = auto()
-    DOCKER_INTERNAL_SYMMETRIC_CLIENT = auto()
-    WINDOWS_VM = auto()
-    MAC_VM = auto()
-    DOCKER_CONE_GW_1 = auto()
-    DOCKER_CONE_GW_2 = auto()
-    DOCKER_CONE_GW_3 = auto()
-    DOCKER_CONE_GW_4 = auto()
-    DOCKER_FULLCONE_GW_1 = auto()
-    DOCKER_FULLCONE_GW_2 = auto()
-    DOCKER_SYMMETRIC_GW_1 = auto()
-    DOCKER_SYMMETRIC_GW_2 = auto()
-    DOCKER_UDP_BLOCK_GW_1 = auto()
-    DOCKER_UDP_BLOCK_GW_2 = auto()
-    DOCKER_UPNP_GW_1 = auto()
-    DOCKER_UPNP_GW_2 = auto()
-    DOCKER_VPN_1 = auto()
-    DOCKER_VPN_2 = auto()
-    DOCKER_INTERNAL_SYMMETRIC_GW = auto()
-
-
-DOCKER_SERVICE_IDS: Dict[ConnectionTag, str] = {
-    ConnectionTag.DOCKER_CONE_CLIENT_1: "cone-client-01",
-    ConnectionTag.DOCKER_CONE_CLIENT_2: "cone-client-02",
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_1: "fullcone-client-01",
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_2: "fullcone-client-02",
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_1: "symmetric-client-01",
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_2: "symmetric-client-02",
-    ConnectionTag.DOCKER_UPNP_CLIENT_1: "upnp-client-01",
-    ConnectionTag.DOCKER_UPNP_CLIENT_2: "upnp-client-02",
-    ConnectionTag.DOCKER_SHARED_CLIENT_1: "shared-client-01",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1: "open-internet-client-01",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2: "open-internet-client-02",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK: (
-        "open-internet-client-dual-stack"
-    ),
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_1: "udp-block-client-01",
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_2: "udp-block-client-02",
-    ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_CLIENT: "internal-symmetric-client-01",
-    ConnectionTag.DOCKER_CONE_GW_1: "cone-gw-01",
-    ConnectionTag.DOCKER_CONE_GW_2: "cone-gw-02",
-    ConnectionTag.DOCKER_CONE_GW_3: "cone-gw-03",
-    ConnectionTag.DOCKER_CONE_GW_4: "cone-gw-04",
-    ConnectionTag.DOCKER_FULLCONE_GW_1: "fullcone-gw-01",
-    ConnectionTag.DOCKER_FULLCONE_GW_2: "fullcone-gw-02",
-    ConnectionTag.DOCKER_SYMMETRIC_GW_1: "symmetric-gw-01",
-    ConnectionTag.DOCKER_SYMMETRIC_GW_2: "symmetric-gw-02",
-    ConnectionTag.DOCKER_UDP_BLOCK_GW_1: "udp-block-gw-01",
-    ConnectionTag.DOCKER_UDP_BLOCK_GW_2: "udp-block-gw-02",
-    ConnectionTag.DOCKER_UPNP_GW_1: "upnp-gw-01",
-    ConnectionTag.DOCKER_UPNP_GW_2: "upnp-gw-02",
-    ConnectionTag.DOCKER_VPN_1: "vpn-01",
-    ConnectionTag.DOCKER_VPN_2: "vpn-02",
-    ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_GW: "internal-symmetric-gw-01",
-}
-
-
-DOCKER_GW_MAP: Dict[ConnectionTag, ConnectionTag] = {
-    ConnectionTag.DOCKER_CONE_CLIENT_1: ConnectionTag.DOCKER_CONE_GW_1,
-    ConnectionTag.DOCKER_CONE_CLIENT_2: ConnectionTag.DOCKER_CONE_GW_2,
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_1: ConnectionTag.DOCKER_FULLCONE_GW_1,
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_2: ConnectionTag.DOCKER_FULLCONE_GW_2,
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_1: ConnectionTag.DOCKER_SYMMETRIC_GW_1,
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_2: ConnectionTag.DOCKER_SYMMETRIC_GW_2,
-    ConnectionTag.DOCKER_UPNP_CLIENT_1: ConnectionTag.DOCKER_UPNP_GW_1,
-    ConnectionTag.DOCKER_UPNP_CLIENT_2: ConnectionTag.DOCKER_UPNP_GW_2,
-    ConnectionTag.DOCKER_SHARED_CLIENT_1: ConnectionTag.DOCKER_CONE_GW_1,
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_1: ConnectionTag.DOCKER_UDP_BLOCK_GW_1,
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_2: ConnectionTag.DOCKER_UDP_BLOCK_GW_2,
-    ConnectionTag.WINDOWS_VM: ConnectionTag.DOCKER_CONE_GW_3,
-    ConnectionTag.MAC_VM: ConnectionTag.DOCKER_CONE_GW_3,
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1: ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1,
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2: ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2,
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK: ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK,
-    ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_CLIENT: ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_GW,
-}
-
-LAN_ADDR_MAP: Dict[ConnectionTag, str] = {
-    ConnectionTag.DOCKER_CONE_CLIENT_1: "192.168.101.104",
-    ConnectionTag.DOCKER_CONE_CLIENT_2: "192.168.102.54",
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_1: "192.168.109.88",
-    ConnectionTag.DOCKER_FULLCONE_CLIENT_2: "192.168.106.88",
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_1: "192.168.103.88",
-    ConnectionTag.DOCKER_SYMMETRIC_CLIENT_2: "192.168.104.88",
-    ConnectionTag.DOCKER_UPNP_CLIENT_1: "192.168.105.88",
-    ConnectionTag.DOCKER_UPNP_CLIENT_2: "192.168.112.88",
-    ConnectionTag.DOCKER_SHARED_CLIENT_1: "192.168.101.67",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1: "10.0.11.2",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2: "10.0.11.3",
-    ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK: "10.0.11.4",
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_1: "192.168.110.100",
-    ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_2: "192.168.111.100",
-    ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_CLIENT: "192.168.114.88",
-    ConnectionTag.WINDOWS_VM: "10.55.0.11",
-    ConnectionTag.MAC_VM: "10.55.0.12",
-    ConnectionTag.DOCKER_CONE_GW_1: "192.168.101.254",
-    ConnectionTag.DOCKER_CONE_GW_2: "192.168.102.254",
-    ConnectionTag.DOCKER_CONE_GW_3: "192.168.107.254",
-    ConnectionTag.DOCKER_CONE_GW_4: "192.168.108.254",
-    ConnectionTag.DOCKER_FULLCONE_GW_1: "192.168.109.254",
-    ConnectionTag.DOCKER_FULLCONE_GW_2: "192.168.106.254",
-    ConnectionTag.DOCKER_SYMMETRIC_GW_1: "192.168.103.254",
-    ConnectionTag.DOCKER_SYMMETRIC_GW_2: "192.168.104.254",
-    ConnectionTag.DOCKER_UDP_BLOCK_GW_1: "192.168.110.254",
-    ConnectionTag.DOCKER_UDP_BLOCK_GW_2: "192.168.111.254",
-    ConnectionTag.DOCKER_UPNP_GW_1: "192.168.105.254",
-    ConnectionTag.DOCKER_UPNP_GW_2: "192.168.112.254",
-    ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_GW: "192.168.114.254",
-}
+# IntEnum with explicit values: identity checks and dict lookups go through
+# cheap int comparisons, and the numbering stays stable if members are
+# reordered
+class ConnectionTag(IntEnum):
+    DOCKER_CONE_CLIENT_1 = 1
+    DOCKER_CONE_CLIENT_2 = 2
+    DOCKER_FULLCONE_CLIENT_1 = 3
+    DOCKER_FULLCONE_CLIENT_2 = 4
+    DOCKER_SYMMETRIC_CLIENT_1 = 5
+    DOCKER_SYMMETRIC_CLIENT_2 = 6
+    DOCKER_UPNP_CLIENT_1 = 7
+    DOCKER_UPNP_CLIENT_2 = 8
+    DOCKER_SHARED_CLIENT_1 = 9
+    DOCKER_OPEN_INTERNET_CLIENT_1 = 10
+    DOCKER_OPEN_INTERNET_CLIENT_2 = 11
+    DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK = 12
+    DOCKER_UDP_BLOCK_CLIENT_1 = 13
+    DOCKER_UDP_BLOCK_CLIENT_2 = 14
+    DOCKER_INTERNAL_SYMMETRIC_CLIENT = 15
+    WINDOWS_VM = 16
+    MAC_VM = 17
+    DOCKER_CONE_GW_1 = 18
+    DOCKER_CONE_GW_2 = 19
+    DOCKER_CONE_GW_3 = 20
+    DOCKER_CONE_GW_4 = 21
+    DOCKER_FULLCONE_GW_1 = 22
+    DOCKER_FULLCONE_GW_2 = 23
+    DOCKER_SYMMETRIC_GW_1 = 24
+    DOCKER_SYMMETRIC_GW_2 = 25
+    DOCKER_UDP_BLOCK_GW_1 = 26
+    DOCKER_UDP_BLOCK_GW_2 = 27
+    DOCKER_UPNP_GW_1 = 28
+    DOCKER_UPNP_GW_2 = 29
+    DOCKER_VPN_1 = 30
+    DOCKER_VPN_2 = 31
+    DOCKER_INTERNAL_SYMMETRIC_GW = 32
+
+
+class TagInfo(NamedTuple):
+    service_id: Optional[str]
+    gw: Optional[ConnectionTag]
+    lan_addr: Optional[str]
+
+
+# Single source of truth for per-tag data; one lookup returns the docker
+# compose service id (None for VMs), the gateway tag (None for nodes without
+# one) and the LAN address. The per-aspect maps below are derived views kept
+# for callers that only care about one column. All of them are wrapped in
+# MappingProxyType so an accidental write fails loudly instead of desyncing
+# the views.
+TAG_INFO: Mapping[ConnectionTag, TagInfo] = MappingProxyType(
+    {
+        ConnectionTag.DOCKER_CONE_CLIENT_1: TagInfo(
+            "cone-client-01", ConnectionTag.DOCKER_CONE_GW_1, "192.168.101.104"
+        ),
+        ConnectionTag.DOCKER_CONE_CLIENT_2: TagInfo(
+            "cone-client-02", ConnectionTag.DOCKER_CONE_GW_2, "192.168.102.54"
+        ),
+        ConnectionTag.DOCKER_FULLCONE_CLIENT_1: TagInfo(
+            "fullcone-client-01", ConnectionTag.DOCKER_FULLCONE_GW_1, "192.168.109.88"
+        ),
+        ConnectionTag.DOCKER_FULLCONE_CLIENT_2: TagInfo(
+            "fullcone-client-02", ConnectionTag.DOCKER_FULLCONE_GW_2, "192.168.106.88"
+        ),
+        ConnectionTag.DOCKER_SYMMETRIC_CLIENT_1: TagInfo(
+            "symmetric-client-01", ConnectionTag.DOCKER_SYMMETRIC_GW_1, "192.168.103.88"
+        ),
+        ConnectionTag.DOCKER_SYMMETRIC_CLIENT_2: TagInfo(
+            "symmetric-client-02", ConnectionTag.DOCKER_SYMMETRIC_GW_2, "192.168.104.88"
+        ),
+        ConnectionTag.DOCKER_UPNP_CLIENT_1: TagInfo(
+            "upnp-client-01", ConnectionTag.DOCKER_UPNP_GW_1, "192.168.105.88"
+        ),
+        ConnectionTag.DOCKER_UPNP_CLIENT_2: TagInfo(
+            "upnp-client-02", ConnectionTag.DOCKER_UPNP_GW_2, "192.168.112.88"
+        ),
+        ConnectionTag.DOCKER_SHARED_CLIENT_1: TagInfo(
+            "shared-client-01", ConnectionTag.DOCKER_CONE_GW_1, "192.168.101.67"
+        ),
+        ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1: TagInfo(
+            "open-internet-client-01",
+            ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_1,
+            "10.0.11.2",
+        ),
+        ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2: TagInfo(
+            "open-internet-client-02",
+            ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_2,
+            "10.0.11.3",
+        ),
+        ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK: TagInfo(
+            "open-internet-client-dual-stack",
+            ConnectionTag.DOCKER_OPEN_INTERNET_CLIENT_DUAL_STACK,
+            "10.0.11.4",
+        ),
+        ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_1: TagInfo(
+            "udp-block-client-01",
+            ConnectionTag.DOCKER_UDP_BLOCK_GW_1,
+            "192.168.110.100",
+        ),
+        ConnectionTag.DOCKER_UDP_BLOCK_CLIENT_2: TagInfo(
+            "udp-block-client-02",
+            ConnectionTag.DOCKER_UDP_BLOCK_GW_2,
+            "192.168.111.100",
+        ),
+        ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_CLIENT: TagInfo(
+            "internal-symmetric-client-01",
+            ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_GW,
+            "192.168.114.88",
+        ),
+        ConnectionTag.WINDOWS_VM: TagInfo(
+            None, ConnectionTag.DOCKER_CONE_GW_3, "10.55.0.11"
+        ),
+        ConnectionTag.MAC_VM: TagInfo(
+            None, ConnectionTag.DOCKER_CONE_GW_3, "10.55.0.12"
+        ),
+        ConnectionTag.DOCKER_CONE_GW_1: TagInfo("cone-gw-01", None, "192.168.101.254"),
+        ConnectionTag.DOCKER_CONE_GW_2: TagInfo("cone-gw-02", None, "192.168.102.254"),
+        ConnectionTag.DOCKER_CONE_GW_3: TagInfo("cone-gw-03", None, "192.168.107.254"),
+        ConnectionTag.DOCKER_CONE_GW_4: TagInfo("cone-gw-04", None, "192.168.108.254"),
+        ConnectionTag.DOCKER_FULLCONE_GW_1: TagInfo(
+            "fullcone-gw-01", None, "192.168.109.254"
+        ),
+        ConnectionTag.DOCKER_FULLCONE_GW_2: TagInfo(
+            "fullcone-gw-02", None, "192.168.106.254"
+        ),
+        ConnectionTag.DOCKER_SYMMETRIC_GW_1: TagInfo(
+            "symmetric-gw-01", None, "192.168.103.254"
+        ),
+        ConnectionTag.DOCKER_SYMMETRIC_GW_2: TagInfo(
+            "symmetric-gw-02", None, "192.168.104.254"
+        ),
+        ConnectionTag.DOCKER_UDP_BLOCK_GW_1: TagInfo(
+            "udp-block-gw-01", None, "192.168.110.254"
+        ),
+        ConnectionTag.DOCKER_UDP_BLOCK_GW_2: TagInfo(
+            "udp-block-gw-02", None, "192.168.111.254"
+        ),
+        ConnectionTag.DOCKER_UPNP_GW_1: TagInfo("upnp-gw-01", None, "192.168.105.254"),
+        ConnectionTag.DOCKER_UPNP_GW_2: TagInfo("upnp-gw-02", None, "192.168.112.254"),
+        ConnectionTag.DOCKER_VPN_1: TagInfo("vpn-01", None, None),
+        ConnectionTag.DOCKER_VPN_2: TagInfo("vpn-02", None, None),
+        ConnectionTag.DOCKER_INTERNAL_SYMMETRIC_GW: TagInfo(
+            "internal-symmetric-gw-01", None, "192.168.114.254"
+        ),
+    }
+)
+
+
+DOCKER_SERVICE_IDS: Mapping[ConnectionTag, str] = MappingProxyType(
+    {
+        tag: info.service_id
+        for tag, info in TAG_INFO.items()
+        if info.service_id is not None
+    }
+)
+
+DOCKER_GW_MAP: Mapping[ConnectionTag, ConnectionTag] = MappingProxyType(
+    {tag: info.gw for tag, info in TAG_INFO.items() if info.gw is not None}
+)
+
+LAN_ADDR_MAP: Mapping[ConnectionTag, str] = MappingProxyType(
+    {tag: info.lan_addr for tag, info in TAG_INFO.items() if info.lan_addr is not None}
+)
+
+
+# Docker clients are cached per event loop: opening one costs a fresh aiohttp
+# session plus an API handshake, and the test harness runs every test on its
+# own loop, so a process-wide singleton would outlive its loop
+_docker_clients: Dict[asyncio.AbstractEventLoop, Docker] = {}
+
+
+async def _get_docker() -> Docker:
+    loop = asyncio.get_running_loop()
+    docker = _docker_clients.get(loop)
+    if docker is None:
+        docker = Docker()
+        _docker_clients[loop] = docker
+    return docker
+
+
+async def close_cached_docker() -> None:
+    """Close the Docker client cached for the current event loop, if any."""
+    docker = _docker_clients.pop(asyncio.get_running_loop(), None)
+    if docker is not None:
+        await docker.close()
+
+
+_LIBTELIO_BINARY_PREFIX: Mapping[TargetOS, str] = MappingProxyType(
+    {
+        TargetOS.Linux: config.LIBTELIO_BINARY_PATH_DOCKER,
+        TargetOS.Windows: config.LIBTELIO_BINARY_PATH_WINDOWS_VM,
+        TargetOS.Mac: config.LIBTELIO_BINARY_PATH_MAC_VM,
+    }
+)
 
 
 def get_libtelio_binary_path(path: str, connection: Connection) -> str:
     target_os = connection.target_os
-    if target_os == TargetOS.Linux:
-        return config.LIBTELIO_BINARY_PATH_DOCKER + path
+    prefix = _LIBTELIO_BINARY_PREFIX.get(target_os)
+    if prefix is None:
+        raise ValueError(f"target_os not supported '{target_os!r}'")
+    return prefix + path
 
-    if target_os == TargetOS.Windows:
-        return config.LIBTELIO_BINARY_PATH_WINDOWS_VM + path
 
-    if target_os == TargetOS.Mac:
-        return config.LIBTELIO_BINARY_PATH_MAC_VM + path
+@asynccontextmanager
+async def _open_docker_connection(tag: ConnectionTag) -> AsyncIterator[Connection]:
+    docker = await _get_docker()
+    async with container_util.get(docker, container_id(tag)) as connection:
+        yield connection
+
 
-    assert False, f"target_os not supported '{target_os}'"
+def _open_windows_connection(_tag: ConnectionTag) -> AsyncContextManager[Connection]:
+    return windows_vm_util.new_connection()
+
+
+def _open_mac_connection(_tag: ConnectionTag) -> AsyncContextManager[Connection]:
+    return mac_vm_util.new_connection()
+
+
+_CONNECTION_OPENERS: Mapping[
+    ConnectionTag, Callable[[ConnectionTag], AsyncContextManager[Connection]]
+] = MappingProxyType(
+    {
+        **{tag: _open_docker_connection for tag in DOCKER_SERVICE_IDS},
+        ConnectionTag.WINDOWS_VM: _open_windows_connection,
+        ConnectionTag.MAC_VM: _open_mac_connection,
+    }
+)
 
 
 @asynccontextmanager
 async def new_connection_raw(tag: ConnectionTag) -> AsyncIterator[Connection]:
-    if tag in DOCKER_SERVICE_IDS:
-        async with Docker() as docker:
-            async with container_util.get(docker, container_id(tag)) as connection:
-                yield connection
+    opener = _CONNECTION_OPENERS.get(tag)
+    if opener is None:
+        raise ValueError(f"tag {tag!r} not supported")
+    async with opener(tag) as connection:
+        yield connection
 
-    elif tag == ConnectionTag.WINDOWS_VM:
-        async with windows_vm_util.new_connection() as connection:
-            yield connection
 
-    elif tag == ConnectionTag.MAC_VM:
-        async with mac_vm_util.new_connection() as connection:
-            yield connection
+async def _docker_network_switcher(connection: Connection) -> NetworkSwitcher:
+    return NetworkSwitcherDocker(connection)
 
-    else:
-        assert False, f"tag {tag} not supported"
 
+async def _mac_network_switcher(connection: Connection) -> NetworkSwitcher:
+    return NetworkSwitcherMac(connection)
 
-async def create_network_switcher(
-    tag: ConnectionTag, connection: Connection
-) -> Optional[NetworkSwitcher]:
-    if tag in DOCKER_SERVICE_IDS:
-        return NetworkSwitcherDocker(connection)
 
-    if tag == ConnectionTag.WINDOWS_VM:
-        return await NetworkSwitcherWindows.create(connection)
+_NETWORK_SWITCHER_FACTORIES: Mapping[
+    ConnectionTag, Callable[[Connection], Awaitable[NetworkSwitcher]]
+] = MappingProxyType(
+    {
+        **{tag: _docker_network_switcher for tag in DOCKER_SERVICE_IDS},
+        ConnectionTag.WINDOWS_VM: NetworkSwitcherWindows.create,
+        ConnectionTag.MAC_VM: _mac_network_switcher,
+    }
+)
 
-    if tag == ConnectionTag.MAC_VM:
-        return NetworkSwitcherMac(connection)
 
-    return None
+async def create_network_switcher(
+    tag: ConnectionTag, connection: Connection
+) -> Optional[NetworkSwitcher]:
+    factory = _NETWORK_SWITCHER_FACTORIES.get(tag)
+    if factory is None:
+        return None
+    return await factory(connection)
 
 
 @asynccontextmanager
@@ -201,21 +308,26 @@ async def new_connection_manager_by_tag(
         Connection, Optional[Connection], Optional[NetworkSwitcher], ConnectionTracker
     ]
 ]:
-    async with new_connection_raw(tag) as connection:
+    async with AsyncExitStack() as stack:
+        enter = stack.enter_async_context
+        gw_tag = DOCKER_GW_MAP.get(tag)
+        if gw_tag is not None:
+            # The client and gateway containers are independent, so both
+            # connections are acquired concurrently
+            connection, gw_connection = await asyncio.gather(
+                enter(new_connection_raw(tag)),
+                enter(new_connection_raw(gw_tag)),
+            )
+        else:
+            connection = await enter(new_connection_raw(tag))
+            gw_connection = None
         network_switcher = await create_network_switcher(tag, connection)
         if network_switcher:
             await network_switcher.switch_to_primary_network()
-        if tag in DOCKER_GW_MAP:
-            async with new_connection_raw(DOCKER_GW_MAP[tag]) as gw_connection:
-                async with ConnectionTracker(
-                    gw_connection, conn_tracker_config
-                ).run() as conn_tracker:
-                    yield (connection, gw_connection, network_switcher, conn_tracker)
-        else:
-            async with ConnectionTracker(
-                connection, conn_tracker_config
-            ).run() as conn_tracker:
-                yield (connection, None, network_switcher, conn_tracker)
+        conn_tracker = await enter(
+            ConnectionTracker(gw_connection or connection, conn_tracker_config).run()
+        )
+        yield (connection, gw_connection, network_switcher, conn_tracker)
 
 
 @asynccontextmanager
@@ -271,94 +383,137 @@ async def new_connection_by_tag(tag: ConnectionTag) -> AsyncIterator[Connection]
         yield connection
 
 
-def container_id(tag: ConnectionTag) -> str:
-    if tag in DOCKER_SERVICE_IDS:
-        return f"nat-lab-{DOCKER_SERVICE_IDS[tag]}-1"
-    assert False, f"tag {tag} not a docker container"
+_CONTAINER_IDS: Mapping[ConnectionTag, str] = MappingProxyType(
+    {tag: f"nat-lab-{service_id}-1" for tag, service_id in DOCKER_SERVICE_IDS.items()}
+)
 
 
-def generate_connection_tracker_config(
-    connection_tag,
-    vpn_1_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    vpn_2_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    stun_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    ping_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    derp_0_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    derp_1_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    derp_2_limits: ConnectionLimits = ConnectionLimits(0, 0),
-    derp_3_limits: ConnectionLimits = ConnectionLimits(0, 0),
-) -> List[ConnectionTrackerConfig]:
-    lan_addr = LAN_ADDR_MAP[connection_tag]
-    return [
-        ConnectionTrackerConfig(
-            "vpn_1",
-            vpn_1_limits,
-            FiveTuple(
-                protocol="udp",
-                src_ip=lan_addr,
-                dst_ip=str(config.WG_SERVER.get("ipv4")),
-                dst_port=51820,
+def container_id(tag: ConnectionTag) -> str:
+    name = _CONTAINER_IDS.get(tag)
+    if name is None:
+        raise ValueError(f"tag {tag!r} not a docker container")
+    return name
+
+
+# Server addresses are plain config constants; converted from the server
+# dicts once here rather than per tag in the template builder
+_WG_SERVER_IP = str(config.WG_SERVER.get("ipv4"))
+_WG_SERVER_2_IP = str(config.WG_SERVER_2.get("ipv4"))
+_DERP_FAKE_IP = str(config.DERP_FAKE.get("ipv4"))
+_DERP_PRIMARY_IP = str(config.DERP_PRIMARY.get("ipv4"))
+_DERP_SECONDARY_IP = str(config.DERP_SECONDARY.get("ipv4"))
+_DERP_TERTIARY_IP = str(config.DERP_TERTIARY.get("ipv4"))
+
+
+def _build_conn_tracker_templates() -> Dict[ConnectionTag, List[Tuple[str, FiveTuple]]]:
+    # Everything in a conn tracker config except the limits is a pure function
+    # of the connection tag and static config, so the five-tuples are built
+    # once at import instead of on every generate_connection_tracker_config()
+    templates: Dict[ConnectionTag, List[Tuple[str, FiveTuple]]] = {}
+    for tag, lan_addr in LAN_ADDR_MAP.items():
+        templates[tag] = [
+            (
+                "vpn_1",
+                FiveTuple(
+                    protocol="udp",
+                    src_ip=lan_addr,
+                    dst_ip=_WG_SERVER_IP,
+                    dst_port=51820,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig(
-            "vpn_2",
-            vpn_2_limits,
-            FiveTuple(
-                protocol="udp",
-                src_ip=lan_addr,
-                dst_ip=str(config.WG_SERVER_2.get("ipv4")),
-                dst_port=51820,
+            (
+                "vpn_2",
+                FiveTuple(
+                    protocol="udp",
+                    src_ip=lan_addr,
+                    dst_ip=_WG_SERVER_2_IP,
+                    dst_port=51820,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig(
-            "stun",
-            stun_limits,
-            FiveTuple(
-                protocol="udp",
-                src_ip=lan_addr,
-                dst_ip=config.STUN_SERVER,
-                dst_port=3478,
+            (
+                "stun",
+                FiveTuple(
+                    protocol="udp",
+                    src_ip=lan_addr,
+                    dst_ip=config.STUN_SERVER,
+                    dst_port=3478,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig("ping", ping_limits, FiveTuple(protocol="icmp")),
-        ConnectionTrackerConfig(
-            "derp_0",
-            derp_0_limits,
-            FiveTuple(
-                protocol="tcp",
-                src_ip=lan_addr,
-                dst_ip=str(config.DERP_FAKE.get("ipv4")),
-                dst_port=8765,
+            ("ping", FiveTuple(protocol="icmp")),
+            (
+                "derp_0",
+                FiveTuple(
+                    protocol="tcp",
+                    src_ip=lan_addr,
+                    dst_ip=_DERP_FAKE_IP,
+                    dst_port=8765,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig(
-            "derp_1",
-            derp_1_limits,
-            FiveTuple(
-                protocol="tcp",
-                src_ip=lan_addr,
-                dst_ip=str(config.DERP_PRIMARY.get("ipv4")),
-                dst_port=8765,
+            (
+                "derp_1",
+                FiveTuple(
+                    protocol="tcp",
+                    src_ip=lan_addr,
+                    dst_ip=_DERP_PRIMARY_IP,
+                    dst_port=8765,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig(
-            "derp_2",
-            derp_2_limits,
-            FiveTuple(
-                protocol="tcp",
-                src_ip=lan_addr,
-                dst_ip=str(config.DERP_SECONDARY.get("ipv4")),
-                dst_port=8765,
+            (
+                "derp_2",
+                FiveTuple(
+                    protocol="tcp",
+                    src_ip=lan_addr,
+                    dst_ip=_DERP_SECONDARY_IP,
+                    dst_port=8765,
+                ),
             ),
-        ),
-        ConnectionTrackerConfig(
-            "derp_3",
-            derp_3_limits,
-            FiveTuple(
-                protocol="tcp",
-                src_ip=lan_addr,
-                dst_ip=str(config.DERP_TERTIARY.get("ipv4")),
-                dst_port=8765,
+            (
+                "derp_3",
+                FiveTuple(
+                    protocol="tcp",
+                    src_ip=lan_addr,
+                    dst_ip=_DERP_TERTIARY_IP,
+                    dst_port=8765,
+                ),
             ),
-        ),
+        ]
+    return templates
+
+
+_CONN_TRACKER_TEMPLATES: Mapping[
+    ConnectionTag, List[Tuple[str, FiveTuple]]
+] = MappingProxyType(_build_conn_tracker_templates())
+
+
+# Limits are never mutated after construction, so all the "no connections
+# allowed" defaults can share one instance
+_ZERO_LIMITS = ConnectionLimits(0, 0)
+
+
+def generate_connection_tracker_config(
+    connection_tag,
+    vpn_1_limits: ConnectionLimits = _ZERO_LIMITS,
+    vpn_2_limits: ConnectionLimits = _ZERO_LIMITS,
+    stun_limits: ConnectionLimits = _ZERO_LIMITS,
+    ping_limits: ConnectionLimits = _ZERO_LIMITS,
+    derp_0_limits: ConnectionLimits = _ZERO_LIMITS,
+    derp_1_limits: ConnectionLimits = _ZERO_LIMITS,
+    derp_2_limits: ConnectionLimits = _ZERO_LIMITS,
+    derp_3_limits: ConnectionLimits = _ZERO_LIMITS,
+) -> List[ConnectionTrackerConfig]:
+    limits = (
+        vpn_1_limits,
+        vpn_2_limits,
+        stun_limits,
+        ping_limits,
+        derp_0_limits,
+        derp_1_limits,
+        derp_2_limits,
+        derp_3_limits,
+    )
+    return [
+        ConnectionTrackerConfig(key, limit, five_tuple)
+        for (key, five_tuple), limit in zip(
+            _CONN_TRACKER_TEMPLATES[connection_tag], limits
+        )
     ]
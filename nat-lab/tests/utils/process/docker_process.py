@@ -114,18 +114,25 @@ class DockerProcess(Process):
                     continue
                 decodeable_lines = lines[:-1]
 
-            output = b"\x0a".join(decodeable_lines).decode(
-                sys.getfilesystemencoding(), errors="replace"
-            )
+            # Lines are already split at the byte level here; decode each one
+            # and deliver it to the callback directly, so handlers don't have
+            # to split the chunk all over again
+            decoded_lines = [
+                raw_line.decode(sys.getfilesystemencoding(), errors="replace")
+                for raw_line in decodeable_lines
+            ]
+            output = "\x0a".join(decoded_lines)
 
             if message.stream == 1:
                 self._stdout += output
                 if stdout_callback:
-                    await stdout_callback(output)
+                    for line in decoded_lines:
+                        await stdout_callback(line)
             elif message.stream == 2:
                 self._stderr += output
                 if stderr_callback:
-                    await stderr_callback(output)
+                    for line in decoded_lines:
+                        await stderr_callback(line)
 
         for stream_id, buffer in buffers.items():
             if buffer:
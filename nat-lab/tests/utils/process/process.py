@@ -2,6 +2,8 @@ from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
 from typing import List, Optional, Callable, Awaitable, AsyncIterator
 
+# Called once per output line; handlers may still run splitlines() on the
+# payload, which is a cheap no-op for a single line
 StreamCallback = Callable[[str], Awaitable[None]]
 
 